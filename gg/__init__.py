@@ -0,0 +1,3 @@
+"""gg: graph based grand canonical basin hopping."""
+
+from gg.gcbh import GrandCanonicalBasinHopping
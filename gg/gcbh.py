@@ -0,0 +1,460 @@
+"""Grand canonical basin hopping driver."""
+
+import atexit
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+from ase import units
+from ase.calculators.singlepoint import SinglePointCalculator
+from ase.io import read, write
+from ase.io.trajectory import Trajectory
+
+from gg.utils import NoReasonableStructureFound, get_ref_coeff
+
+
+def _ref_sum(formula: str, mu_key: tuple) -> float:
+    """Reference potential sum for a formula. mu_key is the chemical
+    potential dict frozen into a sorted tuple of items."""
+    ref_coeff = get_ref_coeff(dict(mu_key), formula)
+    coeff_vec = np.array([ref_coeff[key] for key, _ in mu_key])
+    mu_vec = np.array([value for _, value in mu_key])
+    return float(coeff_vec @ mu_vec)
+
+
+class GrandCanonicalBasinHopping:
+    """Basin hopping in the grand canonical ensemble.
+
+    Trial structures are proposed by registered structure modifiers,
+    relaxed by a user supplied bash script in a scratch subfolder, and
+    accepted with a Metropolis criterion on the free energy referenced
+    to the supplied chemical potentials.
+    """
+
+    def __init__(
+        self,
+        atoms,
+        bash_script: str = "optimize.sh",
+        files_to_copied: list = None,
+        restart: bool = False,
+        chemical_potential: str = "chemical_potentials.dat",
+        logfile: str = "gcbh.log",
+        trajectory: str = "gcbh.traj",
+        config: dict = None,
+    ):
+        """
+        Args:
+            atoms (ase.Atoms or str): starting structure, or a file to read it from
+            bash_script (str): script that relaxes input.traj into optimized.traj
+            files_to_copied (list): files copied into every optimization subfolder
+            restart (bool): continue from a previous run in the same folder
+            chemical_potential (str): file with "species potential" per line
+            logfile (str): text log of the run
+            trajectory (str): trajectory of accepted structures
+            config (dict): overrides for the default run parameters
+        """
+        self.config = {
+            "temp": 1500.0,
+            "max_temp": None,
+            "min_temp": None,
+            "stop_steps": 400,
+            "max_history": 25,
+            "flush_interval": 30.0,
+            "center_moves": True,
+            "verbose_ref": False,
+            "seed": None,
+        }
+        if config:
+            self.config.update(config)
+        if self.config["max_temp"] is None:
+            self.config["max_temp"] = 1.5 * self.config["temp"]
+        if self.config["min_temp"] is None:
+            self.config["min_temp"] = self.config["temp"] / 1.5
+
+        self.rng = np.random.default_rng(self.config["seed"])
+        self.atoms = atoms
+        self._center_moves = self.config["center_moves"]
+        self._verbose_ref = self.config["verbose_ref"]
+        self.bash_script = bash_script
+        self.copied_files = files_to_copied or []
+        self.logfile = open(
+            logfile, "a" if restart else "w", encoding="utf-8", buffering=1 << 16
+        )
+        atexit.register(self.logfile.flush)
+        self.traj = Trajectory(trajectory, mode="a" if restart else "w")
+        self.opt_folder = "opt_folder"
+        self.status_file = "current_status.json"
+
+        self.structure_modifiers = {}
+        self._modifier_names_cache = None
+        self._modifier_weights_cache = None
+        self._alias_prob = None
+        self._alias_table = None
+
+        self.t = self.config["temp"]
+        self.accept_history = deque(maxlen=self.config["max_history"])
+        self.nsteps = 0
+        self.no_improvement_step = 0
+        self.on_optimization = -1
+
+        self.energy = None
+        self.free_energy = None
+        self.free_energy_min = None
+        self._lock = threading.RLock()
+        self._status_dirty = False
+        self._last_flush = 0.0
+
+        self.mu = {}
+        if chemical_potential is not None and os.path.isfile(chemical_potential):
+            with open(chemical_potential, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip() and not line.startswith("#"):
+                        key, value = line.split()[:2]
+                        self.mu[key] = float(value)
+        self._mu_key = tuple(sorted(self.mu.items()))
+
+        self._ref_cache = {}
+        self._ref_cache_dirty = False
+        self._ref_cache_file = os.path.join(self.opt_folder, "ref_cache.json")
+        if os.path.isfile(self._ref_cache_file):
+            with open(self._ref_cache_file, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached.get("mu") == self.mu:
+                self._ref_cache = cached["formulas"]
+
+        if restart and os.path.isfile(self.status_file):
+            self.reload_previous_results()
+
+    @property
+    def atoms(self):
+        """ase.Atoms: structure the simulation currently works on."""
+        return self._atoms
+
+    @atoms.setter
+    def atoms(self, atoms):
+        if isinstance(atoms, str):
+            atoms = read(atoms)
+        self._atoms = atoms
+        self._atoms.arrays = {
+            key: np.ascontiguousarray(value)
+            for key, value in self._atoms.arrays.items()
+        }
+
+    def dumplog(self, msg: str):
+        """Write a timestamped message to the logfile.
+
+        Messages stay in the file buffer; they reach disk at the next
+        status checkpoint, at the end of run, or at interpreter exit.
+        """
+        with self._lock:
+            self.logfile.write(f"{time.strftime('%H:%M:%S')}  {msg.strip()}\n")
+
+    def reload_previous_results(self):
+        """Restore driver state from the status file of a previous run."""
+        with open(self.status_file, "r", encoding="utf-8") as f:
+            status = json.load(f)
+        self.nsteps = status["nsteps"]
+        self.t = status["temp"]
+        self.energy = status["energy"]
+        self.free_energy = status["free_energy"]
+        self.free_energy_min = status["free_energy_min"]
+        self.no_improvement_step = status["no_improvement_step"]
+        self.accept_history = deque(
+            status["accept_history"], maxlen=self.config["max_history"]
+        )
+        if os.path.isfile("current_atoms.traj"):
+            self.atoms = read("current_atoms.traj")
+        self.dumplog(f"Restarted from step {self.nsteps}")
+
+    def save_current_status(self, force: bool = False):
+        """Checkpoint the current structure and driver state to disk.
+
+        Checkpoints are buffered: while an optimization is in flight the
+        write is skipped until flush_interval seconds have passed since
+        the last one, unless force is given. The status file is written
+        to a temp file and moved into place so readers never see a torn
+        checkpoint.
+        """
+        now = time.time()
+        if (
+            not force
+            and self.on_optimization != -1
+            and now - self._last_flush < self.config["flush_interval"]
+        ):
+            self._status_dirty = True
+            return
+        write("current_atoms.traj", self.atoms)
+        status = {
+            "nsteps": self.nsteps,
+            "on_optimization": self.on_optimization,
+            "temp": self.t,
+            "energy": self.energy,
+            "free_energy": self.free_energy,
+            "free_energy_min": self.free_energy_min,
+            "no_improvement_step": self.no_improvement_step,
+            "accept_history": list(self.accept_history),
+            "modifier_weights": {
+                name: instance.weight
+                for name, instance in self.structure_modifiers.items()
+            },
+        }
+        with open(self.status_file + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(status, f, indent=2)
+        os.replace(self.status_file + ".tmp", self.status_file)
+        if self._ref_cache_dirty:
+            os.makedirs(self.opt_folder, exist_ok=True)
+            with open(self._ref_cache_file + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"mu": self.mu, "formulas": self._ref_cache}, f, indent=2)
+            os.replace(self._ref_cache_file + ".tmp", self._ref_cache_file)
+            self._ref_cache_dirty = False
+        self.logfile.flush()
+        self._status_dirty = False
+        self._last_flush = now
+
+    def add_modifier(self, instance, name: str):
+        """Register a structure modifier under the given name."""
+        if name in self.structure_modifiers:
+            raise RuntimeError(f"Modifier {name!r} is already registered")
+        self.structure_modifiers[name] = instance
+        self._modifier_names_cache = None
+        self._modifier_weights_cache = None
+
+    def _build_alias(self):
+        """Build Walker alias tables over the modifier weights, so a
+        weighted draw costs two table lookups regardless of how many
+        modifiers are registered."""
+        names = list(self.structure_modifiers)
+        weights = [self.structure_modifiers[name].weight for name in names]
+        n = len(names)
+        total = sum(weights)
+        scaled = [w * n / total for w in weights]
+        prob = [1.0] * n
+        alias = list(range(n))
+        small = [i for i, s in enumerate(scaled) if s < 1.0]
+        large = [i for i, s in enumerate(scaled) if s >= 1.0]
+        while small and large:
+            i_small = small.pop()
+            i_large = large.pop()
+            prob[i_small] = scaled[i_small]
+            alias[i_small] = i_large
+            scaled[i_large] -= 1.0 - scaled[i_small]
+            if scaled[i_large] < 1.0:
+                small.append(i_large)
+            else:
+                large.append(i_large)
+        self._modifier_names_cache = names
+        self._modifier_weights_cache = weights
+        self._alias_prob = prob
+        self._alias_table = alias
+
+    def select_modifier(self) -> str:
+        """Pick a modifier name with probability proportional to its weight."""
+        if self._modifier_names_cache is None:
+            self._build_alias()
+        names = self._modifier_names_cache
+        i = int(self.rng.random() * len(names))
+        if self.rng.random() < self._alias_prob[i]:
+            return names[i]
+        return names[self._alias_table[i]]
+
+    def update_modifier_weights(self, name: str, action: str):
+        """Reward or penalize a modifier after an accepted or rejected move."""
+        if name not in self.structure_modifiers:
+            raise RuntimeError(f"Unknown modifier {name!r}")
+        if action == "increase":
+            self.structure_modifiers[name].weight *= 1.05
+        elif action == "decrease":
+            self.structure_modifiers[name].weight *= 0.95
+        else:
+            raise RuntimeError("action must be 'increase' or 'decrease'")
+        self._modifier_names_cache = None
+        self._modifier_weights_cache = None
+
+    def get_ref_potential(self, atoms) -> float:
+        """Reference chemical potential contribution for the given atoms."""
+        formula = atoms.get_chemical_formula()
+        try:
+            ref_sum = self._ref_cache[formula]
+        except KeyError:
+            ref_sum = _ref_sum(formula, self._mu_key)
+            self._ref_cache[formula] = ref_sum
+            self._ref_cache_dirty = True
+        if self._verbose_ref:
+            self.dumplog(f"Reference potential for {formula}: {ref_sum:.3f} eV")
+        return ref_sum
+
+    def adjust_temp(self, accept: bool):
+        """Cool down on acceptance, heat up on rejection."""
+        if accept:
+            self.t = max(self.t / 1.05, self.config["min_temp"])
+        else:
+            self.t = min(self.t * 1.05, self.config["max_temp"])
+
+    def move(self, modifier_name: str):
+        """Return a new trial structure proposed by the named modifier.
+
+        The current atoms are handed to the modifier by reference;
+        modifiers copy before mutating (the gg.modifiers convention), so
+        a rejected proposal costs no Atoms copy. Centering only applies
+        to fully non-periodic systems, where the cluster can drift; for
+        slabs and bulk cells it is a no-op cost.
+        """
+        self.dumplog(f"Proposing trial structure with modifier {modifier_name!r}")
+        newatoms = self.structure_modifiers[modifier_name].get_modified_atoms(
+            self.atoms
+        )
+        if newatoms is self.atoms:
+            newatoms = newatoms.copy()
+        if self._center_moves and not newatoms.pbc.any():
+            newatoms.center()
+        return newatoms
+
+    def optimize(self, inatoms, opt_index: int):
+        """Relax inatoms in place by running the optimization script.
+
+        Runs in its own opt_%05d subfolder so several optimizations can
+        proceed concurrently; inatoms is returned for use with futures.
+        """
+        self.dumplog(
+            f"Optimizing structure with {len(inatoms)} atoms in opt_{opt_index:05d}"
+        )
+        topdir = os.getcwd()
+        opt_dir = os.path.join(topdir, self.opt_folder, f"opt_{opt_index:05d}")
+        if not os.path.isdir(opt_dir):
+            os.makedirs(opt_dir)
+        for fname in self.copied_files:
+            src = os.path.join(topdir, fname)
+            dst = os.path.join(opt_dir, fname)
+            if os.path.exists(dst) and os.path.samefile(src, dst):
+                continue
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy(src, dst)
+        write(os.path.join(opt_dir, "input.traj"), inatoms)
+        subprocess.run(
+            ["bash", os.path.join(topdir, self.bash_script)], check=True, cwd=opt_dir
+        )
+        optimized_atoms = read(os.path.join(opt_dir, "optimized.traj"))
+        energy = optimized_atoms.get_potential_energy()
+        forces = optimized_atoms.get_forces()
+        inatoms.set_constraint()
+        inatoms.arrays = {k: v.copy() for k, v in optimized_atoms.arrays.items()}
+        inatoms.set_cell(optimized_atoms.get_cell())
+        inatoms.set_pbc(optimized_atoms.get_pbc())
+        inatoms.set_constraint(optimized_atoms.constraints)
+        inatoms.calc = SinglePointCalculator(inatoms, energy=energy, forces=forces)
+        return inatoms
+
+    def accepting_new_structures(self, newatoms, modifier_name: str):
+        """Metropolis accept/reject of an optimized trial structure.
+
+        Thread safe: the comparison against the current state and every
+        state update happen under the driver lock.
+        """
+        assert newatoms is not None
+        energy = newatoms.get_potential_energy()
+        free_energy = energy - self.get_ref_potential(newatoms)
+
+        with self._lock:
+            if free_energy < self.free_energy:
+                accept = True
+            elif self.rng.random() < np.exp(
+                -(free_energy - self.free_energy) / self.t / units.kB
+            ):
+                accept = True
+            else:
+                accept = False
+
+            if accept:
+                self.atoms = newatoms
+                self.energy = energy
+                self.free_energy = free_energy
+                self.traj.write(newatoms)
+                self.update_modifier_weights(modifier_name, "increase")
+                self.dumplog(f"Accepted, F = {free_energy:.3f} eV")
+            else:
+                self.update_modifier_weights(modifier_name, "decrease")
+                self.dumplog(f"Rejected, F = {free_energy:.3f} eV")
+
+            self.adjust_temp(accept)
+            self.accept_history.append(int(accept))
+
+            if self.free_energy < self.free_energy_min:
+                self.free_energy_min = self.free_energy
+                self.no_improvement_step = 0
+            else:
+                self.no_improvement_step += 1
+
+    def propose_trial(self, maximum_trial: int):
+        """Return (modifier_name, trial_atoms) from the registered modifiers."""
+        for _ in range(maximum_trial):
+            modifier_name = self.select_modifier()
+            try:
+                newatoms = self.move(modifier_name)
+            except NoReasonableStructureFound as err:
+                self.dumplog(f"{modifier_name!r} found no structure: {err}")
+                continue
+            return modifier_name, newatoms
+        raise RuntimeError(f"No trial structure found in {maximum_trial} attempts")
+
+    def run(self, steps: int = 4000, maximum_trial: int = 30, max_workers: int = 1):
+        """Run basin hopping until steps trials or stop_steps stagnation.
+
+        Up to max_workers trial optimizations run concurrently; each
+        finished trial is Metropolis tested against the current state as
+        it arrives, so acceptance stays asynchronous while the expensive
+        optimization calls keep all workers busy.
+        """
+        if self.energy is None:
+            self.optimize(self.atoms, opt_index=self.nsteps)
+            self.energy = self.atoms.get_potential_energy()
+            self.free_energy = self.energy - self.get_ref_potential(self.atoms)
+            self.free_energy_min = self.free_energy
+            self.traj.write(self.atoms)
+
+        opt_index = self.nsteps
+        submitted = 0
+        stop_steps = self.config["stop_steps"]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pending = {}
+            while self.nsteps < steps or pending:
+                stagnated = self.no_improvement_step >= stop_steps
+                while (
+                    not stagnated
+                    and len(pending) < max_workers
+                    and self.nsteps + submitted < steps
+                ):
+                    modifier_name, newatoms = self.propose_trial(maximum_trial)
+                    opt_index += 1
+                    self.on_optimization = opt_index
+                    self.save_current_status()
+                    future = pool.submit(self.optimize, newatoms, opt_index)
+                    pending[future] = modifier_name
+                    submitted += 1
+                if not pending:
+                    if stagnated:
+                        self.dumplog(
+                            f"No improvement in {self.no_improvement_step} "
+                            "steps, stopping"
+                        )
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    modifier_name = pending.pop(future)
+                    submitted -= 1
+                    self.accepting_new_structures(future.result(), modifier_name)
+                    self.nsteps += 1
+                if not pending:
+                    self.on_optimization = -1
+                self.save_current_status()
+        if self._status_dirty:
+            self.save_current_status(force=True)
+        self.logfile.flush()
@@ -0,0 +1,38 @@
+"""Shared utilities for the basin hopping driver."""
+
+import numpy as np
+from ase.formula import Formula
+
+
+class NoReasonableStructureFound(Exception):
+    """Raised by structure modifiers when no acceptable trial structure
+    can be generated."""
+
+
+def get_ref_coeff(mu: dict, formula: str) -> dict:
+    """Express a chemical formula in terms of the reference species in mu.
+
+    Args:
+        mu (dict): reference chemical potentials keyed by species formula
+        formula (str): chemical formula to decompose
+
+    Returns:
+        dict: coefficient of each reference species
+    """
+    ref_species = list(mu)
+    elements = set(Formula(formula).count())
+    for ref in ref_species:
+        elements.update(Formula(ref).count())
+    elements = sorted(elements)
+
+    composition = np.zeros((len(elements), len(ref_species)))
+    for j, ref in enumerate(ref_species):
+        count = Formula(ref).count()
+        for i, element in enumerate(elements):
+            composition[i, j] = count.get(element, 0)
+    target = np.array(
+        [Formula(formula).count().get(element, 0) for element in elements],
+        dtype=float,
+    )
+    coeff, *_ = np.linalg.lstsq(composition, target, rcond=None)
+    return dict(zip(ref_species, coeff))
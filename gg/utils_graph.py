@@ -0,0 +1,176 @@
+"""Helpers to build and compare connectivity graphs of ase.Atoms objects."""
+
+import networkx as nx
+import numpy as np
+from ase import Atom, Atoms
+from ase.data import covalent_radii
+from ase.neighborlist import neighbor_list
+
+try:
+    from numba import njit
+except ImportError:
+    # numba is optional; without it the scalar kernels below still avoid
+    # the temporary arrays of the previous np.cross implementation
+    def njit(*args, **kwargs):
+        def decorator(func):
+            return func
+
+        if args and callable(args[0]):
+            return args[0]
+        return decorator
+
+
+@njit(cache=True, fastmath=True)
+def _squared_cross_norm(p1x, p1y, p1z, p2x, p2y, p2z, p3x, p3y, p3z):
+    ax, ay, az = p2x - p1x, p2y - p1y, p2z - p1z
+    bx, by, bz = p3x - p1x, p3y - p1y, p3z - p1z
+    cx = ay * bz - az * by
+    cy = az * bx - ax * bz
+    cz = ax * by - ay * bx
+    return cx * cx + cy * cy + cz * cz
+
+
+def node_symbol(atom: Atom) -> str:
+    """
+    Args:
+        atom (ase.Atom): atom to tag
+
+    Returns:
+        str: "symbol_index" tag for the atom
+    """
+    return f"{atom.symbol}_{atom.index}"
+
+
+def relative_position(atoms: Atoms, neighbor: int, offset: np.ndarray) -> np.ndarray:
+    """
+    Args:
+        atoms (ase.Atoms):
+        neighbor (int): index of the neighboring atom
+        offset (np.ndarray): periodic image offset of the neighbor
+
+    Returns:
+        np.ndarray: absolute position of the neighbor in the given image
+    """
+    return atoms.positions[neighbor] + offset @ atoms.cell.array
+
+
+def node_match(n1: dict, n2: dict) -> bool:
+    """
+    Args:
+        n1 (dict): node attributes
+        n2 (dict): node attributes
+
+    Returns:
+        bool: True if both nodes carry the same chemical symbol
+    """
+    return n1["symbol"] == n2["symbol"]
+
+
+def is_cycle(g: nx.Graph, nodes: list) -> bool:
+    """
+    Args:
+        g (nx.Graph): graph to search
+        nodes (list): nodes that may form a cycle
+
+    Returns:
+        bool: True if the nodes form a cycle in g
+    """
+    nset = set(nodes)
+    n_edges = sum(1 for u in nset for v in g.adj[u] if v in nset) // 2
+    if n_edges >= len(nset):
+        return True
+    try:
+        nx.find_cycle(g.subgraph(nset))
+        return True
+    except nx.exception.NetworkXNoCycle:
+        return False
+
+
+def are_points_collinear_with_tolerance(
+    p1: np.ndarray, p2: np.ndarray, p3: np.ndarray, tolerance: float = 1e-7
+) -> bool:
+    """
+    Args:
+        p1 (np.ndarray): first point
+        p2 (np.ndarray): second point
+        p3 (np.ndarray): third point
+        tolerance (float): maximum norm of the cross product. Defaults to 1e-7.
+
+    Returns:
+        bool: True if the three points are collinear within tolerance
+    """
+    squared_norm = _squared_cross_norm(
+        p1[0], p1[1], p1[2], p2[0], p2[1], p2[2], p3[0], p3[1], p3[2]
+    )
+    return bool(squared_norm < tolerance * tolerance)
+
+
+def atoms_to_graph(
+    atoms: Atoms, nl, max_bond_ratio: float = 0, max_bond: float = 0
+) -> nx.Graph:
+    """Convert an Atoms object into a graph of bonded atoms.
+
+    Args:
+        atoms (ase.Atoms): atoms to convert
+        nl (ase.neighborlist.NeighborList): neighbor list built for atoms
+        max_bond_ratio (float): tolerance on the sum of covalent radii.
+            Defaults to 0.
+        max_bond (float): fixed maximum bond distance, overrides the
+            covalent-radii criterion when larger. Defaults to 0.
+
+    Returns:
+        nx.Graph: graph keyed by atom index, with one edge per bond
+    """
+    if max_bond_ratio == 0 and max_bond == 0:
+        raise RuntimeError("Please specify max_bond_ratio or max_bond")
+
+    cell = np.asarray(atoms.get_cell())
+    positions = atoms.get_positions()
+    radii = covalent_radii[atoms.numbers]
+
+    edges = []
+    seen = set()
+    if hasattr(nl, "nl") and hasattr(nl.nl, "cutoffs"):
+        # Query all pairs in one C-level sweep; the primitive's cutoffs
+        # already include the skin, so the candidate set matches what
+        # per-atom get_neighbors calls would have returned
+        first, second, displacements = neighbor_list("ijD", atoms, nl.nl.cutoffs)
+        distances = np.linalg.norm(displacements, axis=1)
+        check = np.maximum(
+            max_bond, (radii[first] + radii[second]) * max_bond_ratio
+        )
+        for k in np.flatnonzero(distances <= check):
+            index, neighbor = int(first[k]), int(second[k])
+            pair = (index, neighbor) if index < neighbor else (neighbor, index)
+            if pair in seen:
+                continue
+            seen.add(pair)
+            edges.append(
+                (index, neighbor, {"weight": -displacements[k], "start": index})
+            )
+    else:
+        for index in range(len(atoms)):
+            neighbors, offsets = nl.get_neighbors(index)
+            if len(neighbors) == 0:
+                continue
+            vectors = positions[index] - (positions[neighbors] + offsets @ cell)
+            distances = np.linalg.norm(vectors, axis=1)
+            check = np.maximum(
+                max_bond, (radii[index] + radii[neighbors]) * max_bond_ratio
+            )
+            keep = distances <= check
+            for neighbor, vector in zip(neighbors[keep], vectors[keep]):
+                neighbor = int(neighbor)
+                pair = (index, neighbor) if index < neighbor else (neighbor, index)
+                if pair in seen:
+                    continue
+                seen.add(pair)
+                edges.append((index, neighbor, {"weight": vector, "start": index}))
+
+    g = nx.Graph()
+    g.add_nodes_from(
+        (i, {"symbol": symbol, "index": i})
+        for i, symbol in enumerate(atoms.symbols)
+    )
+    g.add_edges_from(edges)
+    return g